@@ -5,9 +5,10 @@ YouTube Auto Upload Script v2.0
 - Cache + Retry cho Google Sheets API (fix quota 429)
 """
 
-import os, sys, logging, time, random, shutil, ctypes, hashlib
+import os, sys, re, logging, time, random, shutil, ctypes, hashlib, threading, functools
 from types import SimpleNamespace
-from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, time as dtime
 from oauth2client.service_account import ServiceAccountCredentials
 import gspread
 import pyautogui
@@ -38,6 +39,8 @@ except Exception:
     pass
 
 pyautogui.FAILSAFE = False
+# Bỏ pause ngầm 0.1s sau mỗi lệnh pyautogui; nhịp thao tác đã do rsleep() quyết định
+pyautogui.PAUSE = 0
 
 # ================== AUTO-DETECT CONFIG ==================
 def detect_config():
@@ -110,6 +113,9 @@ STATUS_OK = "EDIT XONG"
 STATUS_COL = 48  # AV
 
 # Column indices (zero-based)
+IDX_CODE_A = 0
+IDX_CHANNEL_AI = 34
+IDX_STATUS_AV = STATUS_COL - 1
 IDX_TITLE_BB = 53
 IDX_DESC_BC = 54
 IDX_LINK_BD = 55
@@ -119,6 +125,10 @@ IDX_LINK_BG = 58
 IDX_DATE_BI = 60
 IDX_TIME_BJ = 61
 
+# Sheet NGUON
+SRC_IDX_CODE_G = 6  # zero-based
+SRC_STATUS_COL = 13  # M
+
 UPLOAD_URL = "https://www.youtube.com/upload"
 FOLDER_PATTERN = os.path.join(CFG["LOCAL_DONE_ROOT"], "{code}")
 
@@ -152,8 +162,11 @@ TEMPLATES = {
     "THUNNGHIEM": "thunghiem.png",
 }
 
+ICON_PATHS = {name: os.path.join(ICON_DIR, fname) for name, fname in TEMPLATES.items()}
+
 def icon(name):
-    return os.path.join(ICON_DIR, TEMPLATES.get(name, name))
+    path = ICON_PATHS.get(name)
+    return path if path is not None else os.path.join(ICON_DIR, name)
 
 # ================== RANDOM PARAMS ==================
 RANDOM = SimpleNamespace(
@@ -162,7 +175,7 @@ RANDOM = SimpleNamespace(
     medium=(2.5, 4.0),
     long=(5.0, 8.0),
     mouse_move=(0.25, 0.45),
-    retry_screen_interval=(1.2, 2.0),
+    retry_screen_interval=(0.5, 0.9),
     browser_launch_wait_sec=(12, 20),
     click_timeout_sec=(120, 180),
     click_confidence=(0.70, 0.90),
@@ -177,7 +190,8 @@ def rsleep(bucket="small"):
     time.sleep(r(lo, hi))
 
 # ================== AUTO-UPDATE ==================
-_last_update_check = 0
+_last_update_check = None
+_VERSION_RE = re.compile(r'^VERSION = "([^"]+)"', re.MULTILINE)
 
 def check_for_updates():
     """Kiểm tra và tự động cập nhật nếu có version mới."""
@@ -186,39 +200,44 @@ def check_for_updates():
     if not UPDATE_URL:
         return False
     
-    now = time.time()
-    if now - _last_update_check < UPDATE_CHECK_INTERVAL:
+    now = time.monotonic()
+    if _last_update_check is not None and now - _last_update_check < UPDATE_CHECK_INTERVAL:
         return False
     _last_update_check = now
     
     try:
         logging.info("🔍 Kiểm tra cập nhật...")
-        resp = requests.get(UPDATE_URL, timeout=10)
-        if resp.status_code != 200:
-            return False
-        
-        new_code = resp.text
+        with requests.get(UPDATE_URL, timeout=10, stream=True) as resp:
+            if resp.status_code != 200:
+                return False
+            
+            # Chỉ đọc phần đầu file để tìm version; tải hết khi có version mới
+            chunks = resp.iter_content(chunk_size=4096)
+            head, m, new_code = b"", None, None
+            for chunk in chunks:
+                head += chunk
+                m = _VERSION_RE.search(head.decode("utf-8", errors="ignore"))
+                if m or len(head) >= 65536:
+                    break
+            if m and m.group(1) != VERSION:
+                new_code = (head + b"".join(chunks)).decode(resp.encoding or "utf-8")
         
-        # Tìm version trong code mới
-        for line in new_code.split('\n')[:20]:
-            if line.startswith('VERSION = '):
-                new_version = line.split('"')[1]
-                if new_version != VERSION:
-                    logging.info(f"📥 Phát hiện version mới: {VERSION} → {new_version}")
-                    
-                    # Backup file cũ
-                    script_path = os.path.abspath(__file__)
-                    backup_path = script_path + ".backup"
-                    shutil.copy(script_path, backup_path)
-                    
-                    # Ghi file mới
-                    with open(script_path, 'w', encoding='utf-8') as f:
-                        f.write(new_code)
-                    
-                    logging.info("✅ Đã cập nhật! Khởi động lại script...")
-                    os.execv(sys.executable, [sys.executable] + sys.argv)
-                    return True
-                break
+        if new_code is not None:
+            new_version = m.group(1)
+            logging.info(f"📥 Phát hiện version mới: {VERSION} → {new_version}")
+            
+            # Backup file cũ
+            script_path = os.path.abspath(__file__)
+            backup_path = script_path + ".backup"
+            shutil.copy(script_path, backup_path)
+            
+            # Ghi file mới
+            with open(script_path, 'w', encoding='utf-8') as f:
+                f.write(new_code)
+            
+            logging.info("✅ Đã cập nhật! Khởi động lại script...")
+            os.execv(sys.executable, [sys.executable] + sys.argv)
+            return True
         
         logging.info(f"✅ Đang dùng version mới nhất: {VERSION}")
         return False
@@ -230,6 +249,7 @@ def check_for_updates():
 # ================== GOOGLE SHEETS (với Cache + Retry) ==================
 _CACHE = {}
 _CACHE_TTL = 120  # Cache 2 phút
+_WS_CACHE = {}  # sheet_name -> (client, worksheet)
 
 def retry_api_call(func, max_retries=5, base_delay=10):
     """Retry với exponential backoff khi gặp lỗi 429."""
@@ -248,11 +268,11 @@ def retry_api_call(func, max_retries=5, base_delay=10):
 
 def cached_get_all_values(ws, cache_key):
     """Lấy dữ liệu từ cache nếu còn hạn."""
-    now = time.time()
+    now = time.monotonic()
     if cache_key in _CACHE:
         data, ts = _CACHE[cache_key]
         if now - ts < _CACHE_TTL:
-            logging.debug(f"📦 Cache hit: {cache_key}")
+            logging.debug("📦 Cache hit: %s", cache_key)
             return data
     
     data = retry_api_call(ws.get_all_values)
@@ -267,24 +287,46 @@ def invalidate_cache(cache_key=None):
     else:
         _CACHE.clear()
 
+GS_SCOPES = ("https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive")
+
+_gs_client = None
+
 def gs_client():
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    creds = ServiceAccountCredentials.from_json_keyfile_name(CFG["CREDENTIAL_PATH"], scope)
-    return gspread.authorize(creds)
+    """Client gspread dùng chung cả process; chỉ đọc creds + authorize lần đầu."""
+    global _gs_client
+    if _gs_client is None:
+        creds = ServiceAccountCredentials.from_json_keyfile_name(CFG["CREDENTIAL_PATH"], GS_SCOPES)
+        _gs_client = gspread.authorize(creds)
+    return _gs_client
 
-def get_rows(client, sheet_name):
+def reset_gs_client():
+    """Bỏ client + worksheet đã giữ → chu kỳ sau đọc lại creds.json và mở lại sheet."""
+    global _gs_client
+    _gs_client = None
+    _WS_CACHE.clear()
+
+def get_worksheet(client, sheet_name):
+    """Lấy worksheet, giữ handle theo client để không gọi open() lại mỗi lần."""
+    hit = _WS_CACHE.get(sheet_name)
+    if hit and hit[0] is client:
+        return hit[1]
     ws = client.open(CFG["SPREADSHEET_NAME"]).worksheet(sheet_name)
+    _WS_CACHE[sheet_name] = (client, ws)
+    return ws
+
+def get_rows(client, sheet_name):
+    ws = get_worksheet(client, sheet_name)
     return cached_get_all_values(ws, f"rows_{sheet_name}")
 
 def update_source_status(client, code, status="ĐÃ ĐĂNG"):
     """Cập nhật trạng thái với cache + retry."""
     try:
-        ws = client.open(CFG["SPREADSHEET_NAME"]).worksheet(SOURCE_SHEET)
+        ws = get_worksheet(client, SOURCE_SHEET)
         rows = cached_get_all_values(ws, f"source_{SOURCE_SHEET}")
         
         for i, row in enumerate(rows[1:], start=2):
-            if len(row) > 12 and norm(row[6]) == code:
-                retry_api_call(lambda: ws.update_cell(i, 13, status))
+            if len(row) > SRC_STATUS_COL - 1 and norm(row[SRC_IDX_CODE_G]) == code:
+                retry_api_call(lambda: ws.update_cell(i, SRC_STATUS_COL, status))
                 logging.info(f"✅ Đã cập nhật '{status}' cho mã {code}")
                 invalidate_cache(f"source_{SOURCE_SHEET}")
                 return True
@@ -296,10 +338,21 @@ def update_source_status(client, code, status="ĐÃ ĐĂNG"):
         return False
 
 # ================== HELPERS ==================
+_SCALE = None
+
 def _get_scale():
-    sw, sh = pyautogui.size()
-    iw, ih = pyautogui.screenshot().size
-    return iw / (sw or 1), ih / (sh or 1)
+    """Tỉ lệ ảnh chụp / toạ độ logic; chỉ chụp màn hình ở lần gọi đầu."""
+    global _SCALE
+    if _SCALE is None:
+        sw, sh = pyautogui.size()
+        iw, ih = pyautogui.screenshot().size
+        _SCALE = (iw / (sw or 1), ih / (sh or 1))
+    return _SCALE
+
+def reset_scale():
+    """Tính lại tỉ lệ ở lần click sau (màn hình/RDP có thể đổi độ phân giải)."""
+    global _SCALE
+    _SCALE = None
 
 def _to_logical(x, y):
     sx, sy = _get_scale()
@@ -324,6 +377,8 @@ def paste_text(text):
     pyautogui.hotkey('ctrl', 'v')
     rsleep("tiny")
 
+# Ngày/giờ trong sheet lặp lại rất nhiều giữa các dòng và giữa các lượt chạy
+@functools.lru_cache(maxsize=4096)
 def _parse_date(s):
     for f in ("%d/%m/%Y", "%Y-%m-%d"):
         try:
@@ -332,7 +387,16 @@ def _parse_date(s):
             pass
     return None
 
+@functools.lru_cache(maxsize=4096)
 def _parse_time(s):
+    # Fast path cho dạng cố định HH:MM / HH:MM:SS (chỉ chữ số ASCII), khỏi qua strptime
+    t = s.strip()
+    if len(t) in (5, 8) and t.isascii() and t[2] == ":" and t[:2].isdigit() and t[3:5].isdigit():
+        if len(t) == 5 or (t[5] == ":" and t[6:].isdigit()):
+            try:
+                return dtime(int(t[:2]), int(t[3:5]), int(t[6:]) if len(t) == 8 else 0)
+            except ValueError:
+                return None
     for f in ("%H:%M:%S", "%H:%M"):
         try:
             return datetime.strptime(s.strip(), f).time()
@@ -355,39 +419,90 @@ def open_run_and_execute(cmd):
     pyautogui.press('enter')
     rsleep("medium")
 
+# Lệnh đóng browser chỉ phụ thuộc CFG → dựng sẵn một lần
+_EXENAME = os.path.basename(CFG["RUN_BROWSER_EXE"])
+_EXEBASE = os.path.splitext(_EXENAME)[0]
+CLEAN_TEMP_CMD = 'cmd /c del /q /f /s "%temp%\\*.*" >nul 2>&1'
+# PowerShell close
+_PS_CLOSE = f"$names=@('chrome','msedge','firefox','{_EXEBASE}');$procs=Get-Process -EA 0|?{{$names -contains $_.ProcessName}};foreach($p in $procs){{if($p.MainWindowHandle -ne 0){{$null=$p.CloseMainWindow()}}}}"
+CLOSE_BROWSERS_CMD = f'powershell -NoProfile -WindowStyle Hidden -Command "{_PS_CLOSE}"'
+# Force kill
+KILL_BROWSERS_CMD = f'cmd /c taskkill /F /IM chrome.exe /T 2>nul & taskkill /F /IM msedge.exe /T 2>nul & taskkill /F /IM firefox.exe /T 2>nul & taskkill /F /IM "{_EXENAME}" /T 2>nul'
+
 def close_browsers():
     logging.info("🧹 Đóng browsers...")
-    open_run_and_execute('cmd /c del /q /f /s "%temp%\\*.*" >nul 2>&1')
+    open_run_and_execute(CLEAN_TEMP_CMD)
     rsleep("small")
     
-    exebase = os.path.splitext(os.path.basename(CFG["RUN_BROWSER_EXE"]))[0]
-    exename = os.path.basename(CFG["RUN_BROWSER_EXE"])
-    
-    # PowerShell close
-    ps_close = f"$names=@('chrome','msedge','firefox','{exebase}');$procs=Get-Process -EA 0|?{{$names -contains $_.ProcessName}};foreach($p in $procs){{if($p.MainWindowHandle -ne 0){{$null=$p.CloseMainWindow()}}}}"
-    open_run_and_execute(f'powershell -NoProfile -WindowStyle Hidden -Command "{ps_close}"')
+    open_run_and_execute(CLOSE_BROWSERS_CMD)
     rsleep("small")
     
-    # Force kill
-    skill = f'cmd /c taskkill /F /IM chrome.exe /T 2>nul & taskkill /F /IM msedge.exe /T 2>nul & taskkill /F /IM firefox.exe /T 2>nul & taskkill /F /IM "{exename}" /T 2>nul'
-    open_run_and_execute(skill)
+    open_run_and_execute(KILL_BROWSERS_CMD)
     rsleep("small")
 
 # ================== IMAGE RECOGNITION ==================
-def wait_image(img_path, timeout_sec=30, confidence=0.85):
-    """Chờ ảnh xuất hiện, trả về vị trí hoặc None."""
-    logging.info(f"Chờ ảnh: {os.path.basename(img_path)}...")
-    end = time.time() + timeout_sec
+_MISSING_ICONS = set()
+
+def _icon_missing(img_path):
+    """Ảnh mẫu không tồn tại → báo 1 lần và bỏ qua tới hết chu kỳ, khỏi chờ hết timeout."""
+    if img_path in _MISSING_ICONS:
+        return True
+    if not os.path.isfile(img_path):
+        _MISSING_ICONS.add(img_path)
+        logging.error(f"❌ Thiếu file ảnh mẫu: {img_path}")
+        return True
+    return False
+
+CONF_FALLBACK = (0.8, 0.75, 0.7, 0.65, 0.6)
+
+def confidence_levels(confidence, floor=0.6):
+    """Các mức confidence giảm dần từ `confidence`; bỏ mức cao hơn/trùng vì đã thử ngầm."""
+    return [confidence] + [c for c in CONF_FALLBACK if floor <= c < confidence]
+
+def locate_center_any(img_path, levels):
+    """Chụp màn hình 1 lần rồi dò ảnh theo từng mức confidence → (pos, conf) hoặc (None, None)."""
+    try:
+        screen = pyautogui.screenshot()
+    except Exception:
+        return None, None
     
-    while time.time() < end:
+    def _locate(conf):
         try:
-            pos = pyautogui.locateCenterOnScreen(img_path, confidence=confidence)
-            if pos:
-                logging.info(f"✓ Thấy ảnh tại ({pos.x}, {pos.y})")
-                return pos
+            return pyautogui.locate(img_path, screen, confidence=conf)
         except Exception:
-            pass
+            return None
+    
+    # Cùng 1 khung hình: trượt ở mức thấp nhất thì mọi mức cao hơn cũng trượt
+    # → lúc chờ (chưa có gì trên màn hình) chỉ tốn 1 lần dò thay vì len(levels) lần
+    floor_box = _locate(levels[-1])
+    if not floor_box:
+        return None, None
+    for conf in levels[:-1]:
+        box = _locate(conf)
+        if box:
+            return pyautogui.center(box), conf
+    return pyautogui.center(floor_box), levels[-1]
+
+def _poll_image(img_path, timeout_sec, levels):
+    """Vòng chờ dùng chung cho wait_image / wait_and_click_image → (pos, conf) hoặc (None, None)."""
+    if _icon_missing(img_path):
+        return None, None
+    end = time.monotonic() + timeout_sec
+    
+    while time.monotonic() < end:
+        pos, conf = locate_center_any(img_path, levels)
+        if pos:
+            return pos, conf
         time.sleep(r(*RANDOM.retry_screen_interval))
+    return None, None
+
+def wait_image(img_path, timeout_sec=30, confidence=0.85):
+    """Chờ ảnh xuất hiện, trả về vị trí hoặc None."""
+    logging.info(f"Chờ ảnh: {os.path.basename(img_path)}...")
+    pos, _ = _poll_image(img_path, timeout_sec, [confidence])
+    if pos:
+        logging.info(f"✓ Thấy ảnh tại ({pos.x}, {pos.y})")
+        return pos
     
     logging.warning(f"✗ Không thấy ảnh: {os.path.basename(img_path)}")
     return None
@@ -395,64 +510,82 @@ def wait_image(img_path, timeout_sec=30, confidence=0.85):
 def wait_and_click_image(img_path, timeout_sec=30, confidence=0.85):
     """Chờ ảnh và click với giảm dần confidence."""
     logging.info(f"Chờ + click: {os.path.basename(img_path)}...")
-    end = time.time() + timeout_sec
-    levels = [confidence, 0.8, 0.75, 0.7, 0.65, 0.6]
-    
-    while time.time() < end:
-        for conf in levels:
-            try:
-                pos = pyautogui.locateCenterOnScreen(img_path, confidence=conf)
-                if pos:
-                    click_once(pos.x, pos.y)
-                    logging.info(f"✓ Click ảnh tại ({pos.x}, {pos.y}) conf={conf:.2f}")
-                    return True
-            except Exception:
-                pass
-        time.sleep(r(*RANDOM.retry_screen_interval))
+    pos, conf = _poll_image(img_path, timeout_sec, confidence_levels(confidence))
+    if pos:
+        click_once(pos.x, pos.y)
+        logging.info(f"✓ Click ảnh tại ({pos.x}, {pos.y}) conf={conf:.2f}")
+        return True
     
     logging.warning(f"✗ Không click được: {os.path.basename(img_path)}")
     return False
 
 # ================== FILE HANDLING ==================
-IMG_EXTS = {".jpg", ".jpeg", ".png", ".webp"}
+IMG_EXTS = frozenset({".jpg", ".jpeg", ".png", ".webp"})
+REQUIRED_EXTS = IMG_EXTS | {".mp4", ".srt"}
 
 def has_required_files(dir_path):
     """Kiểm tra thư mục có đủ mp4+srt+ảnh."""
-    if not os.path.isdir(dir_path):
+    has_mp4 = has_srt = has_img = False
+    try:
+        with os.scandir(dir_path) as it:
+            for entry in it:
+                name = entry.name.lower()
+                if name.endswith(".mp4"):
+                    has_mp4 = True
+                elif name.endswith(".srt"):
+                    has_srt = True
+                elif os.path.splitext(name)[1] in IMG_EXTS:
+                    has_img = True
+                if has_mp4 and has_srt and has_img:
+                    return True
+    except OSError:
+        # Không có thư mục / share không truy cập được
         return False
-    names = os.listdir(dir_path)
-    has_mp4 = any(n.lower().endswith(".mp4") for n in names)
-    has_srt = any(n.lower().endswith(".srt") for n in names)
-    has_img = any(os.path.splitext(n)[1].lower() in IMG_EXTS for n in names)
-    return has_mp4 and has_srt and has_img
-
-def get_required_stats(dir_path):
-    """Trả về (count, bytes) của các file bắt buộc."""
-    if not os.path.isdir(dir_path):
-        return (0, 0)
-    total, count = 0, 0
-    for root, _, files in os.walk(dir_path):
-        for name in files:
-            ext = os.path.splitext(name)[1].lower()
-            if ext in (".mp4", ".srt") or ext in IMG_EXTS:
-                try:
-                    total += os.path.getsize(os.path.join(root, name))
-                    count += 1
-                except Exception:
-                    pass
-    return (count, total)
+    return False
+
+def scan_required(dir_path):
+    """Quét một lượt → (đủ mp4+srt+ảnh?, (count, bytes) file bắt buộc kể cả thư mục con)."""
+    has_mp4 = has_srt = has_img = False
+    count, total = 0, 0
+    try:
+        with os.scandir(dir_path) as it:
+            entries = list(it)
+    except OSError:
+        return False, (0, 0)
+    
+    for entry in entries:
+        if entry.is_dir(follow_symlinks=False):
+            c, t = scan_required(entry.path)[1]
+            count += c
+            total += t
+            continue
+        ext = os.path.splitext(entry.name)[1].lower()
+        if ext not in REQUIRED_EXTS:
+            continue
+        if ext == ".mp4":
+            has_mp4 = True
+        elif ext == ".srt":
+            has_srt = True
+        else:
+            has_img = True
+        try:
+            total += entry.stat().st_size  # Windows: lấy từ kết quả scandir, không tốn syscall
+            count += 1
+        except OSError:
+            pass
+    return has_mp4 and has_srt and has_img, (count, total)
 
 def ensure_local_folder(code, delete_server=True):
     """Đảm bảo thư mục local có đủ file."""
     local_folder = os.path.join(CFG["LOCAL_DONE_ROOT"], code)
     server_folder = os.path.join(CFG["SERVER_DONE_ROOT"], code)
     
-    local_ok = os.path.isdir(local_folder) and has_required_files(local_folder)
-    server_ok = has_required_files(server_folder)
+    # Mỗi thư mục chỉ quét một lần: vừa kiểm tra đủ file vừa lấy (count, bytes) để so sánh
+    local_ok, lc = scan_required(local_folder)
+    server_ok, sc = scan_required(server_folder)
     
     if local_ok:
         if server_ok:
-            lc, sc = get_required_stats(local_folder), get_required_stats(server_folder)
             if lc == sc:
                 logging.info(f"✅ Local đủ: {local_folder}")
                 return True
@@ -487,62 +620,85 @@ def ensure_local_folder(code, delete_server=True):
     
     return True
 
-def cleanup_posted_codes():
+# Số luồng copy song song: giới hạn bởi băng thông share RDP, không phải số CPU
+PRESTAGE_WORKERS = 4
+
+def _try_ensure_local_folder(code):
+    try:
+        return ensure_local_folder(code)
+    except Exception:
+        return False
+
+def prestage_codes(codes):
+    """Copy song song nhiều mã từ server về local (I/O-bound, không dùng GUI)."""
+    if not codes:
+        return []
+    # Một mã có thể nằm ở nhiều dòng INPUT: mỗi thư mục chỉ giao cho một luồng,
+    # tránh hai luồng cùng rmtree/copytree hoặc xóa server khi luồng kia đang đọc
+    unique = list(dict.fromkeys(codes))
+    with ThreadPoolExecutor(max_workers=PRESTAGE_WORKERS) as pool:
+        done = dict(zip(unique, pool.map(_try_ensure_local_folder, unique)))
+    return [done[c] for c in codes]
+
+def cleanup_posted_codes(client):
     """Xóa thư mục local của mã đã đăng."""
     logging.info("🧹 Dọn mã đã đăng...")
     try:
-        client = gs_client()
-        ws = client.open(CFG["SPREADSHEET_NAME"]).worksheet(INPUT_SHEET)
-        rows = cached_get_all_values(ws, f"cleanup_{INPUT_SHEET}")
+        # Dùng chung cache với get_rows → main() không phải tải lại sheet INPUT
+        rows = get_rows(client, INPUT_SHEET)
         
+        posted = set()
         for row in rows[1:]:
-            code = row[0].strip() if len(row) > 0 else ""
-            status = row[STATUS_COL-1].strip() if len(row) >= STATUS_COL else ""
+            code = row[IDX_CODE_A].strip() if len(row) > IDX_CODE_A else ""
+            status = row[IDX_STATUS_AV].strip() if len(row) > IDX_STATUS_AV else ""
             if code and status.upper() == "ĐÃ ĐĂNG":
-                folder = os.path.join(CFG["LOCAL_DONE_ROOT"], code)
-                if os.path.isdir(folder):
-                    try:
-                        shutil.rmtree(folder)
-                        logging.info(f"🗑️ Đã xóa: {folder}")
-                    except Exception as e:
-                        logging.warning(f"Không xóa được {folder}: {e}")
+                # normcase: Windows không phân biệt hoa/thường như isdir() trước đây
+                posted.add(os.path.normcase(code))
+        
+        # Quét thư mục DONE một lần thay vì isdir() cho từng mã đã đăng
+        with os.scandir(CFG["LOCAL_DONE_ROOT"]) as it:
+            folders = [e.path for e in it if os.path.normcase(e.name) in posted and e.is_dir()]
+        
+        for folder in folders:
+            try:
+                shutil.rmtree(folder)
+                logging.info(f"🗑️ Đã xóa: {folder}")
+            except Exception as e:
+                logging.warning(f"Không xóa được {folder}: {e}")
     except Exception as e:
         logging.warning(f"Lỗi cleanup: {e}")
 
-def find_row_by_code(rows, code):
+def index_rows_by_code(rows):
+    """Map mã → row (giữ row đầu tiên nếu trùng mã)."""
+    index = {}
     for row in rows[1:]:
-        if row and len(row) > 0 and norm(row[0]) == code:
-            return row
-    return None
+        if row:
+            code = norm(row[IDX_CODE_A])
+            if code:
+                index.setdefault(code, row)
+    return index
 
-def get_all_ready_codes(rows):
-    """Lấy mã cần đăng hôm nay."""
+def get_codes_by_day(rows):
+    """Lấy (mã cần đăng hôm nay, mã ngày mai để pre-stage) trong một lượt duyệt."""
     now = datetime.now()
-    out = []
+    today = now.date()
+    tomorrow = today + timedelta(days=1)
+    ready, upcoming = [], []
     for row in rows[1:]:
-        if len(row) > 61 and norm(row[34]) == CFG["CHANNEL_CODE"] and norm(row[47]) == STATUS_OK:
-            d = _parse_date(norm(row[60]) or "")
-            t = _parse_time(norm(row[61]) or "")
-            if d and t:
-                target = datetime.combine(d, t)
-                if d == now.date() and target > now:
-                    code = norm(row[0])
-                    if code:
-                        out.append(code)
-    return out
-
-def get_tomorrow_codes(rows):
-    """Lấy mã ngày mai để pre-stage."""
-    tomorrow = datetime.now().date() + timedelta(days=1)
-    out = []
-    for row in rows[1:]:
-        if len(row) > 61 and norm(row[34]) == CFG["CHANNEL_CODE"] and norm(row[47]) == STATUS_OK:
-            d = _parse_date(norm(row[60]) or "")
-            if d and d == tomorrow:
-                code = norm(row[0])
-                if code:
-                    out.append(code)
-    return out
+        if len(row) > IDX_TIME_BJ and norm(row[IDX_CHANNEL_AI]) == CFG["CHANNEL_CODE"] and norm(row[IDX_STATUS_AV]) == STATUS_OK:
+            code = norm(row[IDX_CODE_A])
+            if not code:
+                continue
+            d = _parse_date(norm(row[IDX_DATE_BI]) or "")
+            if d == today:
+                # Chỉ parse giờ cho các dòng hôm nay
+                t = _parse_time(norm(row[IDX_TIME_BJ]) or "")
+                if t and datetime.combine(d, t) > now:
+                    ready.append(code)
+            elif d == tomorrow:
+                upcoming.append(code)
+    # Bỏ mã trùng (giữ thứ tự) để không upload/copy một mã hai lần
+    return list(dict.fromkeys(ready)), list(dict.fromkeys(upcoming))
 
 # ================== FILE DIALOGS ==================
 def file_dialog_select_first_mp4(target_folder):
@@ -736,21 +892,13 @@ def handle_step2_flow(active_row):
     # Click taiteplen với retry
     time.sleep(15)
     for attempt in range(3):
-        for conf in [CONF, 0.80, 0.75, 0.70]:
-            try:
-                pos = pyautogui.locateCenterOnScreen(icon("TAITEPLEN"), confidence=conf)
-                if pos:
-                    move_click(pos.x, pos.y)
-                    break
-            except Exception:
-                pass
+        pos, _ = locate_center_any(icon("TAITEPLEN"), confidence_levels(CONF, floor=0.70))
+        if pos:
+            move_click(pos.x, pos.y)
         
-        time.sleep(15)
-        try:
-            if pyautogui.locateCenterOnScreen(icon("TIEPTUC"), confidence=0.70):
-                break
-        except Exception:
-            pass
+        # Chờ tối đa 15s, thấy tieptuc là đi tiếp ngay
+        if wait_image(icon("TIEPTUC"), timeout_sec=15, confidence=0.70):
+            break
     else:
         return False
     
@@ -950,38 +1098,36 @@ def handle_step3_4_flow(active_row, client, code):
 # ================== MAIN ==================
 def main():
     random.seed()
+    reset_scale()
+    # Ảnh mẫu có thể được bổ sung giữa hai chu kỳ → kiểm tra lại từ đầu
+    _MISSING_ICONS.clear()
     
     # Kiểm tra update
     check_for_updates()
     
+    client = gs_client()
+    
     # Dọn mã đã đăng
-    cleanup_posted_codes()
+    cleanup_posted_codes(client)
     
     BROWSER_WAIT = int(r(*RANDOM.browser_launch_wait_sec))
     TIMEOUT = int(r(*RANDOM.click_timeout_sec))
     CONF = r(*RANDOM.click_confidence)
     
-    client = gs_client()
     input_rows = get_rows(client, INPUT_SHEET)
     
     # Lấy mã cần đăng
-    ready_codes = get_all_ready_codes(input_rows)
+    ready_codes, tomorrow = get_codes_by_day(input_rows)
     if not ready_codes:
         logging.info(f"Không có mã cho {CFG['CHANNEL_CODE']} hôm nay")
         
         # Pre-stage ngày mai
-        tomorrow = get_tomorrow_codes(input_rows)
-        for c in tomorrow:
-            try:
-                ensure_local_folder(c)
-            except Exception:
-                pass
+        prestage_codes(tomorrow)
         return
     
-    # Lọc mã có file
-    ready_codes = [c for c in ready_codes if 
-                   has_required_files(os.path.join(CFG["LOCAL_DONE_ROOT"], c)) or 
-                   has_required_files(os.path.join(CFG["SERVER_DONE_ROOT"], c))]
+    # Pre-stage + lọc mã có file (chỉ quét thư mục local/server một lần)
+    staged = prestage_codes(ready_codes)
+    ready_codes = [c for c, ok in zip(ready_codes, staged) if ok]
     
     if not ready_codes:
         logging.info("Không còn mã hợp lệ")
@@ -989,12 +1135,13 @@ def main():
     
     logging.info(f"📋 Đăng {len(ready_codes)} mã: {ready_codes}")
     
-    # Pre-stage
-    for c in ready_codes:
-        try:
-            ensure_local_folder(c)
-        except Exception:
-            pass
+    # Pre-stage ngày mai chạy nền trong lúc upload (chỉ copy file, không đụng GUI).
+    # Bỏ mã cũng có trong danh sách hôm nay: thư mục đó do vòng upload quản lý,
+    # tránh luồng nền rmtree/copytree đúng lúc đang chọn file để upload
+    today = set(ready_codes)
+    tomorrow_bg = [c for c in tomorrow if c not in today]
+    tomorrow_job = threading.Thread(target=prestage_codes, args=(tomorrow_bg,), daemon=True)
+    tomorrow_job.start()
     
     # Mở browser
     logging.info(f"🌐 Mở browser: {CFG['RUN_BROWSER_EXE']}")
@@ -1002,20 +1149,20 @@ def main():
     time.sleep(BROWSER_WAIT)
     
     # Upload từng mã
+    rows_by_code = index_rows_by_code(input_rows)
     first_time = True
     processed = set()
     
     for idx, code in enumerate(ready_codes, 1):
-        if code in processed:
-            continue
-        
         logging.info(f"=== [{idx}/{len(ready_codes)}] CODE: {code} ===")
         
-        active_row = find_row_by_code(input_rows, code)
+        active_row = rows_by_code.get(code)
         if not active_row:
             continue
         
         target_folder = FOLDER_PATTERN.format(code=code)
+        # So lại với server ngay trước khi upload: bản trên server có thể đã được xuất lại
+        # trong lúc chờ các mã trước (mỗi mã ≥ 10 phút)
         if not ensure_local_folder(code):
             continue
         
@@ -1069,13 +1216,8 @@ def main():
     
     logging.info(f"✅ Hoàn thành {len(processed)}/{len(ready_codes)} mã")
     
-    # Pre-stage ngày mai
-    try:
-        tomorrow = get_tomorrow_codes(input_rows)
-        for c in tomorrow:
-            ensure_local_folder(c)
-    except Exception:
-        pass
+    # Chờ pre-stage ngày mai xong
+    tomorrow_job.join()
 
 if __name__ == "__main__":
     while True:
@@ -1094,6 +1236,8 @@ if __name__ == "__main__":
                 time.sleep(5 * 60)
             else:
                 logging.error(f"Lỗi main(): {e}")
+                # Key bị đổi/thu hồi hoặc sheet bị tạo lại → chu kỳ sau tự kết nối lại
+                reset_gs_client()
         
         # Nghỉ 3 tiếng
         time.sleep(3 * 60 * 60)